@@ -29,54 +29,79 @@ import re
 import sys
 import socket
 import signal
+import selectors
 import time
 import argparse
+import functools
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from random import randint
 from os import path
 import smtplib
 import json
+import zlib
+import csv
 
 try:
 	import queue
 except ImportError:
 	import Queue as queue
 
-try:
-	import dns.resolver
-	from dns.exception import DNSException
-	MODULE_DNSPYTHON = True
-except ImportError:
-	MODULE_DNSPYTHON = False
-	pass
+MODULE_DNSPYTHON = False
+MODULE_GEOIP = False
+MODULE_WHOIS = False
+MODULE_SSDEEP = False
+MODULE_REQUESTS = False
 
-try:
-	import GeoIP
-	MODULE_GEOIP = True
-except ImportError:
-	MODULE_GEOIP = False
-	pass
 
-try:
-	import whois
-	MODULE_WHOIS = True
-except ImportError:
-	MODULE_WHOIS = False
-	pass
+def load_modules():
+	# optional modules are imported only once it is clear that the run needs
+	# them, so --format idle does not pay for loading dnspython and friends
+	global dns, DNSException, GeoIP, whois, ssdeep, requests
+	global MODULE_DNSPYTHON, MODULE_GEOIP, MODULE_WHOIS, MODULE_SSDEEP, MODULE_REQUESTS
 
-try:
-	import ssdeep
-	MODULE_SSDEEP = True
-except ImportError:
-	MODULE_SSDEEP = False
+	try:
+		import dns.resolver
+		import dns.message
+		import dns.flags
+		import dns.rcode
+		import dns.rdataclass
+		import dns.inet
+		import dns.exception
+		from dns.exception import DNSException
+		MODULE_DNSPYTHON = True
+	except ImportError:
+		MODULE_DNSPYTHON = False
+		pass
+
+	try:
+		import GeoIP
+		MODULE_GEOIP = True
+	except ImportError:
+		MODULE_GEOIP = False
+		pass
+
+	try:
+		import whois
+		MODULE_WHOIS = True
+	except ImportError:
+		MODULE_WHOIS = False
+		pass
+
+	try:
+		import ssdeep
+		MODULE_SSDEEP = True
+	except ImportError:
+		MODULE_SSDEEP = False
+
+	try:
+		import requests
+		requests.packages.urllib3.disable_warnings()
+		MODULE_REQUESTS = True
+	except ImportError:
+		MODULE_REQUESTS = False
+		pass
 
-try:
-	import requests
-	requests.packages.urllib3.disable_warnings()
-	MODULE_REQUESTS = True
-except ImportError:
-	MODULE_REQUESTS = False
-	pass
 
 DIR = path.abspath(path.dirname(sys.argv[0]))
 DIR_DB = 'database'
@@ -87,10 +112,34 @@ DB_GEOIP = path.exists(FILE_GEOIP)
 DB_TLD = path.exists(FILE_TLD)
 
 REQUEST_TIMEOUT_DNS = 5
+REQUEST_TIMEOUT_DNS_TRY = 1.5
+DNS_REPLICAS = 2
+DNS_INFLIGHT_MAX = 64
 REQUEST_TIMEOUT_HTTP = 5
 REQUEST_TIMEOUT_SMTP = 5
 THREAD_COUNT_DEFAULT = 10
 
+CSV_HEADER = ['fuzzer', 'domain-name', 'dns-a', 'dns-aaaa', 'dns-mx', 'dns-ns', 'geoip-country', 'whois-created', 'whois-updated', 'ssdeep-score']
+
+_RE_RFC3986 = re.compile(
+r'''
+^
+(?:(?P<scheme>[^:/?#\s]+):)?
+(?://(?P<authority>[^/?#\s]*))?
+(?P<path>[^?#\s]*)
+(?:\?(?P<query>[^#\s]*))?
+(?:\#(?P<fragment>[^\s]*))?
+$
+''', re.MULTILINE | re.VERBOSE
+)
+_RE_DOMAIN_ALLOWED = re.compile(r'\A([a-z0-9]+(-[a-z0-9]+)*\.)+[a-z]{2,}\Z', re.IGNORECASE)
+_RE_IDNA_ALLOWED = re.compile(r'(?=^.{4,253}$)(^((?!-)[a-zA-Z0-9-]{1,63}(?<!-)\.)+[a-zA-Z]{2,63}\.?$)', re.IGNORECASE)
+
+# single bit flips of every character that can yield a valid hostname character
+# (0-9, a-z, '-'); flipping any bit of a code point above 255 never does
+_BITFLIPS = {chr(o): [chr(o ^ m) for m in (1, 2, 4, 8, 16, 32, 64, 128)
+	if 48 <= o ^ m <= 57 or 97 <= o ^ m <= 122 or o ^ m == 45] for o in range(256)}
+
 if sys.platform != 'win32' and sys.stdout.isatty():
 	FG_RND = '\x1b[3%dm' % randint(1, 8)
 	FG_RED = '\x1b[31m'
@@ -127,33 +176,75 @@ def p_err(data):
 	sys.stderr.flush()
 
 
-def p_csv(data):
-	global args
-	if args.format == 'csv':
-		sys.stdout.write(data)
-
-
-def p_json(data):
-	global args
-	if args.format == 'json':
-		sys.stdout.write(data)
-
-
 def bye(code):
 	sys.stdout.write(FG_RST + ST_RST)
 	sys.exit(code)
 
 
 def sigint_handler(signal, frame):
-	sys.stdout.write('\nStopping threads... ')
-	sys.stdout.flush()
+	# CSV rows are streamed to stdout, keep the status messages out of them
+	out = sys.stderr if streamer is not None else sys.stdout
+	out.write('\nStopping threads... ')
+	out.flush()
 	for worker in threads:
 		worker.stop()
+		worker.jobs.put(None)
+	for worker in threads:
 		worker.join()
-	sys.stdout.write('Done\n')
+	if streamer is not None:
+		# write out what the workers finished, then let the streamer end
+		streamer.results.put(None)
+		streamer.join()
+	out.write('Done\n')
 	bye(0)
 
 
+@functools.lru_cache(maxsize=65536)
+def idna_encode(domain):
+	try:
+		return domain.encode('idna').decode()
+	except UnicodeError:
+		return None
+
+
+@functools.lru_cache(maxsize=None)
+def load_cc_tld():
+	cc_tld = {}
+	with open(FILE_TLD) as f:
+		lines = f.read().splitlines()
+	for line in lines:
+		sld, sep, tld = line.partition('.')
+		if sep and 2 <= len(sld) <= 4 and len(tld) == 2 and all(ord(c) < 128 for c in line) and sld.isalpha() and tld.isalpha():
+			cc_tld.setdefault(tld, []).append(sld)
+
+	return {tld: frozenset(slds) for tld, slds in cc_tld.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def is_ip_address(address):
+	try:
+		dns.inet.af_for_address(address)
+	except ValueError:
+		return False
+	return True
+
+
+@functools.lru_cache(maxsize=8192)
+def domain_tld(domain):
+	domain = domain.rsplit('.', 2)
+
+	if len(domain) == 2:
+		return domain[0], domain[1]
+
+	if DB_TLD:
+		sld_tld = load_cc_tld().get(domain[2])
+		if sld_tld:
+			if domain[1] in sld_tld:
+				return domain[0], domain[1] + '.' + domain[2]
+
+	return domain[0] + '.' + domain[1], domain[2]
+
+
 class UrlParser():
 
 	def __init__(self, url):
@@ -170,19 +261,7 @@ class UrlParser():
 		self.__parse()
 
 	def __parse(self):
-		re_rfc3986_enhanced = re.compile(
-		r'''
-		^
-		(?:(?P<scheme>[^:/?#\s]+):)?
-		(?://(?P<authority>[^/?#\s]*))?
-		(?P<path>[^?#\s]*)
-		(?:\?(?P<query>[^#\s]*))?
-		(?:\#(?P<fragment>[^\s]*))?
-		$
-		''', re.MULTILINE | re.VERBOSE
-		)
-
-		m_uri = re_rfc3986_enhanced.match(self.url)
+		m_uri = _RE_RFC3986.match(self.url)
 
 		if m_uri:
 			if m_uri.group('scheme'):
@@ -206,8 +285,7 @@ class UrlParser():
 			return False
 		if domain[-1] == '.':
 			domain = domain[:-1]
-		allowed = re.compile('\A([a-z0-9]+(-[a-z0-9]+)*\.)+[a-z]{2,}\Z', re.IGNORECASE)
-		return allowed.match(domain)
+		return _RE_DOMAIN_ALLOWED.match(domain)
 
 	def get_full_uri(self):
 		return self.scheme + '://' + self.domain + self.path + self.query
@@ -215,281 +293,223 @@ class UrlParser():
 
 class DomainFuzz():
 
+	glyphs = {
+	'a': [u'à', u'á', u'â', u'ã', u'ä', u'å', u'ɑ', u'ạ', u'ǎ', u'ă', u'ȧ', u'ą'],
+	'b': ['d', 'lb', u'ʙ', u'ɓ', u'ḃ', u'ḅ', u'ḇ', u'ƅ'],
+	'c': ['e', u'ƈ', u'ċ', u'ć', u'ç', u'č', u'ĉ'],
+	'd': ['b', 'cl', 'dl', u'ɗ', u'đ', u'ď', u'ɖ', u'ḑ', u'ḋ', u'ḍ', u'ḏ', u'ḓ'],
+	'e': ['c', u'é', u'è', u'ê', u'ë', u'ē', u'ĕ', u'ě', u'ė', u'ẹ', u'ę', u'ȩ', u'ɇ', u'ḛ'],
+	'f': [u'ƒ', u'ḟ'],
+	'g': ['q', u'ɢ', u'ɡ', u'ġ', u'ğ', u'ǵ', u'ģ', u'ĝ', u'ǧ', u'ǥ'],
+	'h': ['lh', u'ĥ', u'ȟ', u'ħ', u'ɦ', u'ḧ', u'ḩ', u'ⱨ', u'ḣ', u'ḥ', u'ḫ', u'ẖ'],
+	'i': ['1', 'l', u'í', u'ì', u'ï', u'ı', u'ɩ', u'ǐ', u'ĭ', u'ỉ', u'ị', u'ɨ', u'ȋ', u'ī'],
+	'j': [u'ʝ', u'ɉ'],
+	'k': ['lk', 'ik', 'lc', u'ḳ', u'ḵ', u'ⱪ', u'ķ'],
+	'l': ['1', 'i', u'ɫ', u'ł'],
+	'm': ['n', 'nn', 'rn', 'rr', u'ṁ', u'ṃ', u'ᴍ', u'ɱ', u'ḿ'],
+	'n': ['m', 'r', u'ń', u'ṅ', u'ṇ', u'ṉ', u'ñ', u'ņ', u'ǹ', u'ň', u'ꞑ'],
+	'o': ['0', u'ȯ', u'ọ', u'ỏ', u'ơ', u'ó', u'ö'],
+	'p': [u'ƿ', u'ƥ', u'ṕ', u'ṗ'],
+	'q': ['g', u'ʠ'],
+	'r': [u'ʀ', u'ɼ', u'ɽ', u'ŕ', u'ŗ', u'ř', u'ɍ', u'ɾ', u'ȓ', u'ȑ', u'ṙ', u'ṛ', u'ṟ'],
+	's': [u'ʂ', u'ś', u'ṣ', u'ṡ', u'ș', u'ŝ', u'š'],
+	't': [u'ţ', u'ŧ', u'ṫ', u'ṭ', u'ț', u'ƫ'],
+	'u': [u'ᴜ', u'ǔ', u'ŭ', u'ü', u'ʉ', u'ù', u'ú', u'û', u'ũ', u'ū', u'ų', u'ư', u'ů', u'ű', u'ȕ', u'ȗ', u'ụ'],
+	'v': [u'ṿ', u'ⱱ', u'ᶌ', u'ṽ', u'ⱴ'],
+	'w': ['vv', u'ŵ', u'ẁ', u'ẃ', u'ẅ', u'ⱳ', u'ẇ', u'ẉ', u'ẘ'],
+	'y': [u'ʏ', u'ý', u'ÿ', u'ŷ', u'ƴ', u'ȳ', u'ɏ', u'ỿ', u'ẏ', u'ỵ'],
+	'z': [u'ʐ', u'ż', u'ź', u'ᴢ', u'ƶ', u'ẓ', u'ẕ', u'ⱬ']
+	}
+
+	qwerty = {
+	'1': '2q', '2': '3wq1', '3': '4ew2', '4': '5re3', '5': '6tr4', '6': '7yt5', '7': '8uy6', '8': '9iu7', '9': '0oi8', '0': 'po9',
+	'q': '12wa', 'w': '3esaq2', 'e': '4rdsw3', 'r': '5tfde4', 't': '6ygfr5', 'y': '7uhgt6', 'u': '8ijhy7', 'i': '9okju8', 'o': '0plki9', 'p': 'lo0',
+	'a': 'qwsz', 's': 'edxzaw', 'd': 'rfcxse', 'f': 'tgvcdr', 'g': 'yhbvft', 'h': 'ujnbgy', 'j': 'ikmnhu', 'k': 'olmji', 'l': 'kop',
+	'z': 'asx', 'x': 'zsdc', 'c': 'xdfv', 'v': 'cfgb', 'b': 'vghn', 'n': 'bhjm', 'm': 'njk'
+	}
+	qwertz = {
+	'1': '2q', '2': '3wq1', '3': '4ew2', '4': '5re3', '5': '6tr4', '6': '7zt5', '7': '8uz6', '8': '9iu7', '9': '0oi8', '0': 'po9',
+	'q': '12wa', 'w': '3esaq2', 'e': '4rdsw3', 'r': '5tfde4', 't': '6zgfr5', 'z': '7uhgt6', 'u': '8ijhz7', 'i': '9okju8', 'o': '0plki9', 'p': 'lo0',
+	'a': 'qwsy', 's': 'edxyaw', 'd': 'rfcxse', 'f': 'tgvcdr', 'g': 'zhbvft', 'h': 'ujnbgz', 'j': 'ikmnhu', 'k': 'olmji', 'l': 'kop',
+	'y': 'asx', 'x': 'ysdc', 'c': 'xdfv', 'v': 'cfgb', 'b': 'vghn', 'n': 'bhjm', 'm': 'njk'
+	}
+	azerty = {
+	'1': '2a', '2': '3za1', '3': '4ez2', '4': '5re3', '5': '6tr4', '6': '7yt5', '7': '8uy6', '8': '9iu7', '9': '0oi8', '0': 'po9',
+	'a': '2zq1', 'z': '3esqa2', 'e': '4rdsz3', 'r': '5tfde4', 't': '6ygfr5', 'y': '7uhgt6', 'u': '8ijhy7', 'i': '9okju8', 'o': '0plki9', 'p': 'lo0m',
+	'q': 'zswa', 's': 'edxwqz', 'd': 'rfcxse', 'f': 'tgvcdr', 'g': 'yhbvft', 'h': 'ujnbgy', 'j': 'iknhu', 'k': 'olji', 'l': 'kopm', 'm': 'lp',
+	'w': 'sxq', 'x': 'wsdc', 'c': 'xdfv', 'v': 'cfgb', 'b': 'vghn', 'n': 'bhj'
+	}
+	keyboards = [ qwerty, qwertz, azerty ]
+
+	# neighbouring keys of every key on any of the layouts above
+	neighbors = {}
+	for keys in keyboards:
+		for key in keys:
+			neighbors[key] = ''.join(sorted(set(neighbors.get(key, '') + keys[key])))
+	del keys, key
+
 	def __init__(self, domain):
-		self.domain, self.tld = self.__domain_tld(domain)
+		self.domain, self.tld = domain_tld(domain)
 		self.domains = []
-		self.qwerty = {
-		'1': '2q', '2': '3wq1', '3': '4ew2', '4': '5re3', '5': '6tr4', '6': '7yt5', '7': '8uy6', '8': '9iu7', '9': '0oi8', '0': 'po9',
-		'q': '12wa', 'w': '3esaq2', 'e': '4rdsw3', 'r': '5tfde4', 't': '6ygfr5', 'y': '7uhgt6', 'u': '8ijhy7', 'i': '9okju8', 'o': '0plki9', 'p': 'lo0',
-		'a': 'qwsz', 's': 'edxzaw', 'd': 'rfcxse', 'f': 'tgvcdr', 'g': 'yhbvft', 'h': 'ujnbgy', 'j': 'ikmnhu', 'k': 'olmji', 'l': 'kop',
-		'z': 'asx', 'x': 'zsdc', 'c': 'xdfv', 'v': 'cfgb', 'b': 'vghn', 'n': 'bhjm', 'm': 'njk'
-		}
-		self.qwertz = {
-		'1': '2q', '2': '3wq1', '3': '4ew2', '4': '5re3', '5': '6tr4', '6': '7zt5', '7': '8uz6', '8': '9iu7', '9': '0oi8', '0': 'po9',
-		'q': '12wa', 'w': '3esaq2', 'e': '4rdsw3', 'r': '5tfde4', 't': '6zgfr5', 'z': '7uhgt6', 'u': '8ijhz7', 'i': '9okju8', 'o': '0plki9', 'p': 'lo0',
-		'a': 'qwsy', 's': 'edxyaw', 'd': 'rfcxse', 'f': 'tgvcdr', 'g': 'zhbvft', 'h': 'ujnbgz', 'j': 'ikmnhu', 'k': 'olmji', 'l': 'kop',
-		'y': 'asx', 'x': 'ysdc', 'c': 'xdfv', 'v': 'cfgb', 'b': 'vghn', 'n': 'bhjm', 'm': 'njk'
-		}
-		self.azerty = {
-		'1': '2a', '2': '3za1', '3': '4ez2', '4': '5re3', '5': '6tr4', '6': '7yt5', '7': '8uy6', '8': '9iu7', '9': '0oi8', '0': 'po9',
-		'a': '2zq1', 'z': '3esqa2', 'e': '4rdsz3', 'r': '5tfde4', 't': '6ygfr5', 'y': '7uhgt6', 'u': '8ijhy7', 'i': '9okju8', 'o': '0plki9', 'p': 'lo0m',
-		'q': 'zswa', 's': 'edxwqz', 'd': 'rfcxse', 'f': 'tgvcdr', 'g': 'yhbvft', 'h': 'ujnbgy', 'j': 'iknhu', 'k': 'olji', 'l': 'kopm', 'm': 'lp',
-		'w': 'sxq', 'x': 'wsdc', 'c': 'xdfv', 'v': 'cfgb', 'b': 'vghn', 'n': 'bhj'
-		}
-		self.keyboards = [ self.qwerty, self.qwertz, self.azerty ]
-
-	def __domain_tld(self, domain):
-		domain = domain.rsplit('.', 2)
-
-		if len(domain) == 2:
-			return domain[0], domain[1]
-
-		if DB_TLD:
-			cc_tld = {}
-			re_tld = re.compile('^[a-z]{2,4}\.[a-z]{2}$', re.IGNORECASE)
-
-			for line in open(FILE_TLD):
-				line = line[:-1]
-				if re_tld.match(line):
-					sld, tld = line.split('.')
-					if not tld in cc_tld:
-						cc_tld[tld] = []
-					cc_tld[tld].append(sld)
-
-			sld_tld = cc_tld.get(domain[2])
-			if sld_tld:
-				if domain[1] in sld_tld:
-					return domain[0], domain[1] + '.' + domain[2]
-
-		return domain[0] + '.' + domain[1], domain[2]
 
 	def __validate_domain(self, domain):
 		try:
-			domain_idna = domain.encode('idna').decode()
-		except UnicodeError:
+			domain.encode('ascii')
+		except UnicodeEncodeError:
+			pass
+		else:
+			# IDNA leaves ASCII labels untouched; empty or oversized labels
+			# it would reject are rejected by the regex below as well
+			return _RE_IDNA_ALLOWED.match(domain)
+		domain_idna = idna_encode(domain)
+		if domain_idna is None:
 			# '.tla'.encode('idna') raises UnicodeError: label empty or too long
 			# This can be obtained when __omission takes a one-letter domain.
 			return False
 		if len(domain) == len(domain_idna) and domain != domain_idna:
 			return False
-		allowed = re.compile('(?=^.{4,253}$)(^((?!-)[a-zA-Z0-9-]{1,63}(?<!-)\.)+[a-zA-Z]{2,63}\.?$)', re.IGNORECASE)
-		return allowed.match(domain_idna)
-
-	def __filter_domains(self):
-		seen = set()
-		filtered = []
-
-		for d in self.domains:
-			#if not self.__validate_domain(d['domain-name']):
-				#p_err("debug: invalid domain %s\n" % d['domain-name'])
-			if self.__validate_domain(d['domain-name']) and d['domain-name'] not in seen:
-				seen.add(d['domain-name'])
-				filtered.append(d)
+		return _RE_IDNA_ALLOWED.match(domain_idna)
 
-		self.domains = filtered
+	def filter_domains(self):
+		self.domains = [d for d in self.domains if self.__validate_domain(d['domain-name'])]
 
 	def __bitsquatting(self):
 		result = []
-		masks = [1, 2, 4, 8, 16, 32, 64, 128]
 		for i in range(0, len(self.domain)):
-			c = self.domain[i]
-			for j in range(0, len(masks)):
-				b = chr(ord(c) ^ masks[j])
-				o = ord(b)
-				if (o >= 48 and o <= 57) or (o >= 97 and o <= 122) or o == 45:
-					result.append(self.domain[:i] + b + self.domain[i+1:])
+			for b in _BITFLIPS.get(self.domain[i], ()):
+				result.append(self.domain[:i] + b + self.domain[i+1:])
 
 		return result
 
 	def __homoglyph(self):
-		glyphs = {
-		'a': [u'à', u'á', u'â', u'ã', u'ä', u'å', u'ɑ', u'ạ', u'ǎ', u'ă', u'ȧ', u'ą'],
-		'b': ['d', 'lb', u'ʙ', u'ɓ', u'ḃ', u'ḅ', u'ḇ', u'ƅ'],
-		'c': ['e', u'ƈ', u'ċ', u'ć', u'ç', u'č', u'ĉ'],
-		'd': ['b', 'cl', 'dl', u'ɗ', u'đ', u'ď', u'ɖ', u'ḑ', u'ḋ', u'ḍ', u'ḏ', u'ḓ'],
-		'e': ['c', u'é', u'è', u'ê', u'ë', u'ē', u'ĕ', u'ě', u'ė', u'ẹ', u'ę', u'ȩ', u'ɇ', u'ḛ'],
-		'f': [u'ƒ', u'ḟ'],
-		'g': ['q', u'ɢ', u'ɡ', u'ġ', u'ğ', u'ǵ', u'ģ', u'ĝ', u'ǧ', u'ǥ'],
-		'h': ['lh', u'ĥ', u'ȟ', u'ħ', u'ɦ', u'ḧ', u'ḩ', u'ⱨ', u'ḣ', u'ḥ', u'ḫ', u'ẖ'],
-		'i': ['1', 'l', u'í', u'ì', u'ï', u'ı', u'ɩ', u'ǐ', u'ĭ', u'ỉ', u'ị', u'ɨ', u'ȋ', u'ī'],
-		'j': [u'ʝ', u'ɉ'],
-		'k': ['lk', 'ik', 'lc', u'ḳ', u'ḵ', u'ⱪ', u'ķ'],
-		'l': ['1', 'i', u'ɫ', u'ł'],
-		'm': ['n', 'nn', 'rn', 'rr', u'ṁ', u'ṃ', u'ᴍ', u'ɱ', u'ḿ'],
-		'n': ['m', 'r', u'ń', u'ṅ', u'ṇ', u'ṉ', u'ñ', u'ņ', u'ǹ', u'ň', u'ꞑ'],
-		'o': ['0', u'ȯ', u'ọ', u'ỏ', u'ơ', u'ó', u'ö'],
-		'p': [u'ƿ', u'ƥ', u'ṕ', u'ṗ'],
-		'q': ['g', u'ʠ'],
-		'r': [u'ʀ', u'ɼ', u'ɽ', u'ŕ', u'ŗ', u'ř', u'ɍ', u'ɾ', u'ȓ', u'ȑ', u'ṙ', u'ṛ', u'ṟ'],
-		's': [u'ʂ', u'ś', u'ṣ', u'ṡ', u'ș', u'ŝ', u'š'],
-		't': [u'ţ', u'ŧ', u'ṫ', u'ṭ', u'ț', u'ƫ'],
-		'u': [u'ᴜ', u'ǔ', u'ŭ', u'ü', u'ʉ', u'ù', u'ú', u'û', u'ũ', u'ū', u'ų', u'ư', u'ů', u'ű', u'ȕ', u'ȗ', u'ụ'],
-		'v': [u'ṿ', u'ⱱ', u'ᶌ', u'ṽ', u'ⱴ'],
-		'w': ['vv', u'ŵ', u'ẁ', u'ẃ', u'ẅ', u'ⱳ', u'ẇ', u'ẉ', u'ẘ'],
-		'y': [u'ʏ', u'ý', u'ÿ', u'ŷ', u'ƴ', u'ȳ', u'ɏ', u'ỿ', u'ẏ', u'ỵ'],
-		'z': [u'ʐ', u'ż', u'ź', u'ᴢ', u'ƶ', u'ẓ', u'ẕ', u'ⱬ']
-		}
-
-		result_1pass = set()
-
-		for ws in range(1, len(self.domain)):
-			for i in range(0, (len(self.domain)-ws)+1):
-				win = self.domain[i:i+ws]
-				j = 0
-				while j < ws:
-					c = win[j]
-					if c in glyphs:
-						win_copy = win
-						for g in glyphs[c]:
-							win = win.replace(c, g)
-							result_1pass.add(self.domain[:i] + win + self.domain[i+ws:])
-							win = win_copy
-					j += 1
+		def substitute_once(domain):
+			# every glyph replaces a run of consecutive occurrences of its
+			# letter (anything a window shorter than the domain can span),
+			# which yields look-alike runs such as 'oo' -> '00'
+			positions = {}
+			for i, c in enumerate(domain):
+				if c in self.glyphs:
+					positions.setdefault(c, []).append(i)
+			result = set()
+			for c, pos in positions.items():
+				for a in range(len(pos)):
+					for b in range(a, len(pos)):
+						if pos[b] - pos[a] >= len(domain) - 1:
+							break
+						head, run, tail = domain[:pos[a]], domain[pos[a]:pos[b]+1], domain[pos[b]+1:]
+						for g in self.glyphs[c]:
+							result.add(head + run.replace(c, g) + tail)
+			return result
+
+		result_1pass = substitute_once(self.domain)
 
 		result_2pass = set()
 
 		for domain in result_1pass:
-			for ws in range(1, len(domain)):
-				for i in range(0, (len(domain)-ws)+1):
-					win = domain[i:i+ws]
-					j = 0
-					while j < ws:
-						c = win[j]
-						if c in glyphs:
-							win_copy = win
-							for g in glyphs[c]:
-								win = win.replace(c, g)
-								result_2pass.add(domain[:i] + win + domain[i+ws:])
-								win = win_copy
-						j += 1
-
-		return list(result_1pass | result_2pass)
-
-	def __hyphenation(self):
-		result = []
+			result_2pass |= substitute_once(domain)
 
-		for i in range(1, len(self.domain)):
-			result.append(self.domain[:i] + '-' + self.domain[i:])
+		return (result_1pass | result_2pass) - {self.domain}
 
-		return result
+	def __hyphenation(self):
+		return [self.domain[:i] + '-' + self.domain[i:] for i in range(1, len(self.domain))]
 
 	def __insertion(self):
-		result = []
+		result = set()
 
 		for i in range(1, len(self.domain)-1):
-			for keys in self.keyboards:
-				if self.domain[i] in keys:
-					for c in keys[self.domain[i]]:
-						result.append(self.domain[:i] + c + self.domain[i] + self.domain[i+1:])
-						result.append(self.domain[:i] + self.domain[i] + c + self.domain[i+1:])
+			prefix, orig_c, suffix = self.domain[:i], self.domain[i], self.domain[i+1:]
+			for c in self.neighbors.get(orig_c, ''):
+				result.add(prefix + c + orig_c + suffix)
+				result.add(prefix + orig_c + c + suffix)
 
-		return list(set(result))
+		return result
 
 	def __omission(self):
-		result = []
-
-		for i in range(0, len(self.domain)):
-			result.append(self.domain[:i] + self.domain[i+1:])
+		result = {self.domain[:i] + self.domain[i+1:] for i in range(0, len(self.domain))}
 
-		n = re.sub(r'(.)\1+', r'\1', self.domain)
+		n = self.domain[:1] + ''.join(c for p, c in zip(self.domain, self.domain[1:]) if c != p)
 
-		if n not in result and n != self.domain:
-			result.append(n)
+		if n != self.domain:
+			result.add(n)
 
-		return list(set(result))
+		return result
 
 	def __repetition(self):
-		result = []
+		result = set()
 
 		for i in range(0, len(self.domain)):
 			if self.domain[i].isalpha():
-				result.append(self.domain[:i] + self.domain[i] + self.domain[i] + self.domain[i+1:])
+				result.add(self.domain[:i] + self.domain[i] + self.domain[i] + self.domain[i+1:])
 
-		return list(set(result))
+		return result
 
 	def __replacement(self):
-		result = []
-
-		for i in range(0, len(self.domain)):
-			for keys in self.keyboards:
-				if self.domain[i] in keys:
-					for c in keys[self.domain[i]]:
-						result.append(self.domain[:i] + c + self.domain[i+1:])
-
-		return list(set(result))
+		return {self.domain[:i] + c + self.domain[i+1:] for i in range(0, len(self.domain)) for c in self.neighbors.get(self.domain[i], '')}
 
 	def __subdomain(self):
-		result = []
-
-		for i in range(1, len(self.domain)):
-			if self.domain[i] not in ['-', '.'] and self.domain[i-1] not in ['-', '.']:
-				result.append(self.domain[:i] + '.' + self.domain[i:])
-
-		return result
+		return [self.domain[:i] + '.' + self.domain[i:] for i in range(1, len(self.domain))
+			if self.domain[i] not in '-.' and self.domain[i-1] not in '-.']
 
 	def __transposition(self):
-		result = []
-
-		for i in range(0, len(self.domain)-1):
-			if self.domain[i+1] != self.domain[i]:
-				result.append(self.domain[:i] + self.domain[i+1] + self.domain[i] + self.domain[i+2:])
-
-		return result
+		return [self.domain[:i] + self.domain[i+1] + self.domain[i] + self.domain[i+2:] for i in range(0, len(self.domain)-1)
+			if self.domain[i+1] != self.domain[i]]
 
 	def __vowel_swap(self):
 		vowels = 'aeiou'
-		result = []
+		result = set()
 
 		for i in range(0, len(self.domain)):
-			for vowel in vowels:
-				if self.domain[i] in vowels:
-					result.append(self.domain[:i] + vowel + self.domain[i+1:])
+			if self.domain[i] in vowels:
+				for vowel in vowels:
+					result.add(self.domain[:i] + vowel + self.domain[i+1:])
 
-		return list(set(result))
+		return result
 
 	def __addition(self):
-		result = []
-
-		for i in range(97, 123):
-			result.append(self.domain + chr(i))
-
-		return result
+		return [self.domain + c for c in 'abcdefghijklmnopqrstuvwxyz']
 
 	def generate(self):
-		self.domains.append({ 'fuzzer': 'Original*', 'domain-name': self.domain + '.' + self.tld })
-
-		for domain in self.__addition():
-			self.domains.append({ 'fuzzer': 'Addition', 'domain-name': domain + '.' + self.tld })
-		for domain in self.__bitsquatting():
-			self.domains.append({ 'fuzzer': 'Bitsquatting', 'domain-name': domain + '.' + self.tld })
-		for domain in self.__homoglyph():
-			self.domains.append({ 'fuzzer': 'Homoglyph', 'domain-name': domain + '.' + self.tld })
-		for domain in self.__hyphenation():
-			self.domains.append({ 'fuzzer': 'Hyphenation', 'domain-name': domain + '.' + self.tld })
-		for domain in self.__insertion():
-			self.domains.append({ 'fuzzer': 'Insertion', 'domain-name': domain + '.' + self.tld })
-		for domain in self.__omission():
-			self.domains.append({ 'fuzzer': 'Omission', 'domain-name': domain + '.' + self.tld })
-		for domain in self.__repetition():
-			self.domains.append({ 'fuzzer': 'Repetition', 'domain-name': domain + '.' + self.tld })
-		for domain in self.__replacement():
-			self.domains.append({ 'fuzzer': 'Replacement', 'domain-name': domain + '.' + self.tld })
-		for domain in self.__subdomain():
-			self.domains.append({ 'fuzzer': 'Subdomain', 'domain-name': domain + '.' + self.tld })
-		for domain in self.__transposition():
-			self.domains.append({ 'fuzzer': 'Transposition', 'domain-name': domain + '.' + self.tld })
-		for domain in self.__vowel_swap():
-			self.domains.append({ 'fuzzer': 'Vowel-swap', 'domain-name': domain + '.' + self.tld })
+		suffix = '.' + self.tld
+
+		self.domains.append({ 'fuzzer': 'Original*', 'domain-name': self.domain + suffix })
+		seen = {self.domain + suffix}
+
+		fuzzers = (
+			('Addition', self.__addition),
+			('Bitsquatting', self.__bitsquatting),
+			('Homoglyph', self.__homoglyph),
+			('Hyphenation', self.__hyphenation),
+			('Insertion', self.__insertion),
+			('Omission', self.__omission),
+			('Repetition', self.__repetition),
+			('Replacement', self.__replacement),
+			('Subdomain', self.__subdomain),
+			('Transposition', self.__transposition),
+			('Vowel-swap', self.__vowel_swap),
+		)
+
+		for fuzzer, func in fuzzers:
+			for domain in func():
+				domain += suffix
+				if domain not in seen:
+					seen.add(domain)
+					self.domains.append({ 'fuzzer': fuzzer, 'domain-name': domain })
 
+		various = []
 		if '.' in self.tld:
-			self.domains.append({ 'fuzzer': 'Various', 'domain-name': self.domain + '.' + self.tld.split('.')[-1] })
-			self.domains.append({ 'fuzzer': 'Various', 'domain-name': self.domain + self.tld })
+			various.append(self.domain + '.' + self.tld.split('.')[-1])
+			various.append(self.domain + self.tld)
 		if '.' not in self.tld:
-			self.domains.append({ 'fuzzer': 'Various', 'domain-name': self.domain + self.tld + '.' + self.tld })
+			various.append(self.domain + self.tld + '.' + self.tld)
 		if self.tld != 'com' and '.' not in self.tld:
-			self.domains.append({ 'fuzzer': 'Various', 'domain-name': self.domain + '-' + self.tld + '.com' })
+			various.append(self.domain + '-' + self.tld + '.com')
+
+		for domain in various:
+			if domain not in seen:
+				seen.add(domain)
+				self.domains.append({ 'fuzzer': 'Various', 'domain-name': domain })
 
-		self.__filter_domains()
+		self.filter_domains()
 
 
 class DomainDict(DomainFuzz):
@@ -501,10 +521,9 @@ class DomainDict(DomainFuzz):
 
 	def load_dict(self, file):
 		if path.exists(file):
-			for word in open(file):
-				word = word.strip('\n')
-				if word.isalpha() and word not in self.dictionary:
-					self.dictionary.append(word)
+			with open(file) as f:
+				words = f.read().splitlines()
+			self.dictionary = list(dict.fromkeys(self.dictionary + [word for word in words if word.isalpha()]))
 
 	def __dictionary(self):
 		result = []
@@ -526,8 +545,9 @@ class DomainDict(DomainFuzz):
 		return result
 
 	def generate(self):
-		for domain in self.__dictionary():
-			self.domains.append({ 'fuzzer': 'Dictionary', 'domain-name': domain + '.' + self.tld })
+		suffix = '.' + self.tld
+		self.domains.extend({ 'fuzzer': 'Dictionary', 'domain-name': domain + suffix } for domain in self.__dictionary())
+		self.filter_domains()
 
 
 class TldDict(DomainDict):
@@ -537,6 +557,7 @@ class TldDict(DomainDict):
 			self.dictionary.remove(self.tld)
 		for tld in self.dictionary:
 				self.domains.append({'fuzzer': 'TLD-swap', 'domain-name': self.domain + '.' + tld})
+		self.filter_domains()
 
 
 class DomainThread(threading.Thread):
@@ -553,13 +574,19 @@ class DomainThread(threading.Thread):
 		self.uri_path = ''
 		self.uri_query = ''
 
+		self.results = None
+
 		self.option_extdns = False
+		self.resolver = None
+		self.ns_limits = {}
 		self.option_geoip = False
 		self.option_whois = False
 		self.option_ssdeep = False
 		self.option_banners = False
 		self.option_mxcheck = False
 
+		self.dns_pool = ThreadPoolExecutor(max_workers=3)
+
 	def __banner_http(self, ip, vhost):
 		try:
 			http = socket.socket()
@@ -608,125 +635,256 @@ class DomainThread(threading.Thread):
 		else:
 			return True
 
+	def __race(self, name, rdtype, nameservers):
+		request = dns.message.make_query(name, rdtype)
+		wire = request.to_wire()
+
+		# a fresh socket per race keeps the source port random and the number
+		# of open descriptors bounded by the in-flight limits
+		socks = []
+		sel = selectors.DefaultSelector()
+		try:
+			error = None
+			for ns in nameservers:
+				try:
+					sock = socket.socket(dns.inet.af_for_address(ns), socket.SOCK_DGRAM)
+				except OSError as err:
+					error = err
+					continue
+				socks.append(sock)
+				try:
+					sock.connect((ns, self.resolver.port))
+					sock.send(wire)
+				except OSError as err:
+					error = err
+				else:
+					sel.register(sock, selectors.EVENT_READ)
+			if not sel.get_map() and error is not None:
+				# out of descriptors or no route at all -- this is not an answer
+				raise error
+
+			deadline = time.monotonic() + REQUEST_TIMEOUT_DNS
+			retry_wait = REQUEST_TIMEOUT_DNS_TRY
+			retry_at = time.monotonic() + retry_wait
+			while sel.get_map():
+				now = time.monotonic()
+				if now >= deadline:
+					break
+				events = sel.select(max(0, min(deadline, retry_at) - now))
+				if not events:
+					# nothing back yet -- the query or the reply may have been
+					# dropped, so send it again and back off before the next try
+					for key in sel.get_map().values():
+						try:
+							key.fileobj.send(wire)
+						except OSError:
+							pass
+					retry_wait *= 2
+					retry_at = time.monotonic() + retry_wait
+					continue
+				for key, _ in events:
+					sock = key.fileobj
+					try:
+						response = dns.message.from_wire(sock.recv(65535))
+					except Exception:
+						# ICMP unreachable or garbage -- give up on this replica
+						sel.unregister(sock)
+						continue
+					if not request.is_response(response):
+						continue
+					if response.flags & dns.flags.TC:
+						return self.resolver.query(name, rdtype)
+					if response.rcode() == dns.rcode.NXDOMAIN:
+						raise dns.resolver.NXDOMAIN
+					if response.rcode() == dns.rcode.NOERROR:
+						# hand the reply to dnspython so CNAME chains are followed
+						# like in resolver.query(); 1.x raises NoAnswer on its own,
+						# 2.x leaves rrset set to None
+						question = request.question[0]
+						answer = dns.resolver.Answer(question.name, question.rdtype, dns.rdataclass.IN, response)
+						if answer.rrset is None:
+							raise dns.resolver.NoAnswer
+						return answer
+					# SERVFAIL, REFUSED etc. -- keep waiting for the other replicas
+					sel.unregister(sock)
+		finally:
+			sel.close()
+			for sock in socks:
+				sock.close()
+
+		raise dns.exception.Timeout
+
+	def __lookup(self, name, rdtype, nameservers, race):
+		# acquired in a fixed order so that two lookups can never deadlock
+		limits = [self.ns_limits[ns] for ns in sorted(set(nameservers))]
+		for limit in limits:
+			limit.acquire()
+		try:
+			if race:
+				return self.__race(name, rdtype, nameservers)
+			return self.resolver.query(name, rdtype)
+		finally:
+			for limit in limits:
+				limit.release()
+
+	def __resolve(self, name, rdtype):
+		nameservers = self.resolver.nameservers
+		if len(nameservers) < 2 or not all(is_ip_address(ns) for ns in nameservers):
+			# the race speaks plain UDP only, anything else (e.g. DoH URLs)
+			# is left to dnspython
+			return self.__lookup(name, rdtype, nameservers, False)
+		if len(nameservers) <= DNS_REPLICAS:
+			return self.__lookup(name, rdtype, nameservers, True)
+
+		# spread the names over all nameservers, but pin every lookup of a
+		# name to the same replicas so that what their caches learnt while
+		# resolving its NS serves the A, AAAA and MX queries
+		start = zlib.crc32(name.encode()) % len(nameservers)
+		nameservers = (nameservers + nameservers)[start:start + len(nameservers)]
+		replicas = [nameservers[i:i + DNS_REPLICAS] for i in range(0, len(nameservers), DNS_REPLICAS)]
+		for group in replicas[:-1]:
+			try:
+				return self.__lookup(name, rdtype, group, True)
+			except (dns.exception.Timeout, OSError):
+				# no usable answer from these replicas, fail over to the next
+				pass
+		return self.__lookup(name, rdtype, replicas[-1], True)
+
+	def __query(self, name, rdtype):
+		try:
+			return self.answer_to_list(self.__resolve(name, rdtype))
+		except DNSException:
+			return None
+
 	def stop(self):
 		self.kill_received = True
 
 	@staticmethod
 	def answer_to_list(answers):
-		return sorted(list(map(lambda record: str(record).strip(".") if len(str(record).split(' ')) == 1 else str(record).split(' ')[1].strip('.'), answers)))
-
-	def run(self):
-		while not self.kill_received:
+		# A/AAAA/NS records are a single field, MX is "preference exchange"
+		return sorted(str(record).split(' ')[-1].strip('.') for record in answers)
+
+	def __process(self, domain):
+		domain_idna = idna_encode(domain['domain-name'])
+		if domain_idna is None:
+			# rejected by the IDNA codec (e.g. a label over 63 characters),
+			# there is nothing that could be looked up
+			if self.results is not None:
+				self.results.put(domain)
+			return
+		domain['domain-name'] = domain_idna
+
+		if self.option_extdns:
+			nxdomain = False
 			try:
-				domain = self.jobs.get(block=False)
-			except queue.Empty:
-				self.kill_received = True
-				return
-
-			domain['domain-name'] = domain['domain-name'].encode('idna').decode()
-
-			if self.option_extdns:
-				resolv = dns.resolver.Resolver()
-				resolv.lifetime = REQUEST_TIMEOUT_DNS
-				resolv.timeout = REQUEST_TIMEOUT_DNS
-
-				if args.nameservers:
-					resolv.nameservers = args.nameservers.split(",")
-				if args.port:
-					resolv.port = args.port
-
-				nxdomain = False
+				domain['dns-ns'] = self.answer_to_list(self.__resolve(domain['domain-name'], 'NS'))
+			except dns.resolver.NXDOMAIN:
+				nxdomain = True
+				pass
+			except DNSException:
+				pass
+
+			if nxdomain is False:
+				rdtypes = ['A', 'AAAA']
+				if 'dns-ns' in domain:
+					rdtypes.append('MX')
+
+				futures = [(rdtype, self.dns_pool.submit(self.__query, domain['domain-name'], rdtype)) for rdtype in rdtypes]
+				for rdtype, future in futures:
+					answers = future.result()
+					if answers is not None:
+						domain['dns-' + rdtype.lower()] = answers
+		else:
+			try:
+				ip = socket.getaddrinfo(domain['domain-name'], 80)
+			except Exception:
+				pass
+			else:
+				domain['dns-a'] = list()
+				domain['dns-aaaa'] = list()
+				for j in ip:
+					if '.' in j[4][0]:
+						domain['dns-a'].append(j[4][0])
+					if ':' in j[4][0]:
+						domain['dns-aaaa'].append(j[4][0])
+				domain['dns-a'] = sorted(domain['dns-a'])
+				domain['dns-aaaa'] = sorted(domain['dns-aaaa'])
+
+		if self.option_mxcheck:
+			if 'dns-mx' in domain:
+				if domain['domain-name'] is not self.domain_orig:
+					if self.__mxcheck(domain['dns-mx'][0], self.domain_orig, domain['domain-name']):
+						domain['mx-spy'] = True
+
+		if self.option_whois:
+			if nxdomain is False and 'dns-ns' in domain:
 				try:
-					domain['dns-ns'] = self.answer_to_list(resolv.query(domain['domain-name'], 'NS'))
-				except dns.resolver.NXDOMAIN:
-					nxdomain = True
-					pass
-				except DNSException:
+					whoisdb = whois.query(domain['domain-name'])
+					domain['whois-created'] = str(whoisdb.creation_date).split(' ')[0]
+					domain['whois-updated'] = str(whoisdb.last_updated).split(' ')[0]
+				except Exception:
 					pass
 
-				if nxdomain is False:
-					try:
-						domain['dns-a'] = self.answer_to_list(resolv.query(domain['domain-name'], 'A'))
-					except DNSException:
-						pass
-
-					try:
-						domain['dns-aaaa'] = self.answer_to_list(resolv.query(domain['domain-name'], 'AAAA'))
-					except DNSException:
-						pass
-
-				if nxdomain is False and 'dns-ns' in domain:
-					try:
-						domain['dns-mx'] = self.answer_to_list(resolv.query(domain['domain-name'], 'MX'))
-					except DNSException:
-						pass
-			else:
+		if self.option_geoip:
+			if 'dns-a' in domain:
+				gi = GeoIP.open(FILE_GEOIP, GeoIP.GEOIP_INDEX_CACHE | GeoIP.GEOIP_CHECK_CACHE)
 				try:
-					ip = socket.getaddrinfo(domain['domain-name'], 80)
+					country = gi.country_name_by_addr(domain['dns-a'][0])
 				except Exception:
 					pass
 				else:
-					domain['dns-a'] = list()
-					domain['dns-aaaa'] = list()
-					for j in ip:
-						if '.' in j[4][0]:
-							domain['dns-a'].append(j[4][0])
-						if ':' in j[4][0]:
-							domain['dns-aaaa'].append(j[4][0])
-					domain['dns-a'] = sorted(domain['dns-a'])
-					domain['dns-aaaa'] = sorted(domain['dns-aaaa'])
-
-			if self.option_mxcheck:
-				if 'dns-mx' in domain:
-					if domain['domain-name'] is not self.domain_orig:
-						if self.__mxcheck(domain['dns-mx'][0], self.domain_orig, domain['domain-name']):
-							domain['mx-spy'] = True
-
-			if self.option_whois:
-				if nxdomain is False and 'dns-ns' in domain:
-					try:
-						whoisdb = whois.query(domain['domain-name'])
-						domain['whois-created'] = str(whoisdb.creation_date).split(' ')[0]
-						domain['whois-updated'] = str(whoisdb.last_updated).split(' ')[0]
-					except Exception:
-						pass
+					if country:
+						domain['geoip-country'] = country.split(',')[0]
+
+		if self.option_banners:
+			if 'dns-a' in domain:
+				banner = self.__banner_http(domain['dns-a'][0], domain['domain-name'])
+				if banner:
+					domain['banner-http'] = banner
+			if 'dns-mx' in domain:
+				banner = self.__banner_smtp(domain['dns-mx'][0])
+				if banner:
+					domain['banner-smtp'] = banner
+
+		if self.option_ssdeep:
+			if 'dns-a' in domain:
+				try:
+					req = requests.get(self.uri_scheme + '://' + domain['domain-name'] + self.uri_path + self.uri_query, timeout=REQUEST_TIMEOUT_HTTP, headers={'User-Agent': args.useragent}, verify=False)
+					#ssdeep_fuzz = ssdeep.hash(req.text.replace(' ', '').replace('\n', ''))
+					ssdeep_fuzz = ssdeep.hash(req.text)
+				except Exception:
+					pass
+				else:
+					if req.status_code // 100 == 2:
+						domain['ssdeep-score'] = ssdeep.compare(self.ssdeep_orig, ssdeep_fuzz)
 
-			if self.option_geoip:
-				if 'dns-a' in domain:
-					gi = GeoIP.open(FILE_GEOIP, GeoIP.GEOIP_INDEX_CACHE | GeoIP.GEOIP_CHECK_CACHE)
-					try:
-						country = gi.country_name_by_addr(domain['dns-a'][0])
-					except Exception:
-						pass
-					else:
-						if country:
-							domain['geoip-country'] = country.split(',')[0]
-
-			if self.option_banners:
-				if 'dns-a' in domain:
-					banner = self.__banner_http(domain['dns-a'][0], domain['domain-name'])
-					if banner:
-						domain['banner-http'] = banner
-				if 'dns-mx' in domain:
-					banner = self.__banner_smtp(domain['dns-mx'][0])
-					if banner:
-						domain['banner-smtp'] = banner
-
-			if self.option_ssdeep:
-				if 'dns-a' in domain:
-					try:
-						req = requests.get(self.uri_scheme + '://' + domain['domain-name'] + self.uri_path + self.uri_query, timeout=REQUEST_TIMEOUT_HTTP, headers={'User-Agent': args.useragent}, verify=False)
-						#ssdeep_fuzz = ssdeep.hash(req.text.replace(' ', '').replace('\n', ''))
-						ssdeep_fuzz = ssdeep.hash(req.text)
-					except Exception:
-						pass
-					else:
-						if req.status_code // 100 == 2:
-							domain['ssdeep-score'] = ssdeep.compare(self.ssdeep_orig, ssdeep_fuzz)
+		domain['domain-name'] = domain['domain-name'].encode().decode('idna')
+
+		if self.results is not None:
+			self.results.put(domain)
 
-			domain['domain-name'] = domain['domain-name'].encode().decode('idna')
+	def run(self):
+		while not self.kill_received:
+			domain = self.jobs.get()
+			if domain is None:
+				self.jobs.task_done()
+				break
+
+			# one broken domain must not take the worker down with it, and the
+			# job is always accounted for or the main thread would keep waiting
+			name = domain['domain-name']
+			try:
+				self.__process(domain)
+			except Exception as err:
+				p_err('error: %s: %s\n' % (name, err))
+				# report the domain with whatever was found before it failed
+				domain['domain-name'] = name
+				if self.results is not None:
+					self.results.put(domain)
+			finally:
+				self.jobs.task_done()
 
-			self.jobs.task_done()
+		self.dns_pool.shutdown(wait=False)
 
 
 def one_or_all(answers):
@@ -740,47 +898,55 @@ def one_or_all(answers):
 	return result
 
 
-def generate_json(domains):
+def write_json(domains, output):
 	json_domains = domains
 	for domain in json_domains:
-		domain['domain-name'] = domain['domain-name'].lower().encode('idna').decode()
+		domain['domain-name'] = idna_encode(domain['domain-name'].lower())
 		domain['fuzzer'] = domain['fuzzer'].lower()
 
-	return json.dumps(json_domains, indent=4, sort_keys=True)
+	json.dump(json_domains, output, indent=4, sort_keys=True)
 
 
-def generate_csv(domains):
-	output = 'fuzzer,domain-name,dns-a,dns-aaaa,dns-mx,dns-ns,geoip-country,whois-created,whois-updated,ssdeep-score\n'
+def csv_row(domain):
+	return [domain.get('fuzzer'),
+		idna_encode(domain.get('domain-name')),
+		one_or_all(domain.get('dns-a', [''])),
+		one_or_all(domain.get('dns-aaaa', [''])),
+		one_or_all(domain.get('dns-mx', [''])),
+		one_or_all(domain.get('dns-ns', [''])),
+		domain.get('geoip-country', ''),
+		domain.get('whois-created', ''),
+		domain.get('whois-updated', ''),
+		domain.get('ssdeep-score', '')]
 
-	for domain in domains:
-		output += '%s,%s,%s,%s,%s,%s,%s,%s,%s,%s\n' % (domain.get('fuzzer'),
-			domain.get('domain-name').encode('idna').decode(),
-			one_or_all(domain.get('dns-a', [''])),
-			one_or_all(domain.get('dns-aaaa', [''])),
-			one_or_all(domain.get('dns-mx', [''])),
-			one_or_all(domain.get('dns-ns', [''])),
-			domain.get('geoip-country', ''),
-			domain.get('whois-created', ''),
-			domain.get('whois-updated', ''),
-			str(domain.get('ssdeep-score', '')))
 
-	return output
+def stream_csv(results):
+	writer = csv.writer(sys.stdout, lineterminator='\n')
 
+	writer.writerow(CSV_HEADER)
+	sys.stdout.flush()
 
-def generate_idle(domains):
-	output = ''
+	while True:
+		domain = results.get()
+		if domain is None:
+			break
+		if not args.registered or len(domain) > 2:
+			writer.writerow(csv_row(domain))
+		if results.empty():
+			sys.stdout.flush()
 
-	for domain in domains:
-		output += '%s\n' % domain.get('domain-name').encode('idna').decode()
+	sys.stdout.flush()
 
-	return output
+
+def write_idle(domains, output):
+	for domain in domains:
+		output.write(idna_encode(domain.get('domain-name')) + '\n')
 
 
-def generate_cli(domains):
-	output = ''
+def write_cli(domains, output):
 
-	width_fuzzer = max([len(d['fuzzer']) for d in domains]) + 1
-	width_domain = max([len(d['domain-name']) for d in domains]) + 1
+	width_fuzzer = max(len(d['fuzzer']) for d in domains) + 1
+	width_domain = max(len(d['domain-name']) for d in domains) + 1
 
 	for domain in domains:
 		info = ''
@@ -827,9 +993,7 @@ def generate_cli(domains):
 		if not info:
 			info = '-'
 
-		output += '%s%s%s %s %s\n' % (FG_BLU, domain['fuzzer'].ljust(width_fuzzer), FG_RST, domain['domain-name'].ljust(width_domain), info)
-
-	return output
+		output.write('%s%s%s %s %s\n' % (FG_BLU, domain['fuzzer'].ljust(width_fuzzer), FG_RST, domain['domain-name'].ljust(width_domain), info))
 
 
 def main():
@@ -900,10 +1064,21 @@ def main():
 		tlddict.generate()
 		domains += tlddict.domains
 
+	seen = set()
+	unique = []
+	for domain in domains:
+		if domain['domain-name'] not in seen:
+			seen.add(domain['domain-name'])
+			unique.append(domain)
+	duplicates = len(domains) - len(unique)
+	domains = unique
+
 	if args.format == 'idle':
-		sys.stdout.write(generate_idle(domains))
+		write_idle(domains, sys.stdout)
 		bye(0)
 
+	load_modules()
+
 	if not DB_TLD:
 		p_err('error: missing TLD database file: %s\n' % FILE_TLD)
 		bye(-1)
@@ -963,18 +1138,46 @@ def main():
 			else:
 				args.ssdeep = False
 
-	p_cli('Processing %d domain variants ' % len(domains))
+	if duplicates:
+		p_cli('Processing %d domain variants (%d duplicates skipped) ' % (len(domains), duplicates))
+	else:
+		p_cli('Processing %d domain variants ' % len(domains))
 
 	jobs = queue.Queue()
 
-	global threads
+	global threads, streamer
 	threads = []
+	streamer = None
+
+	for domain in domains:
+		jobs.put(domain)
+
+	if MODULE_DNSPYTHON:
+		resolv = dns.resolver.Resolver()
+		resolv.lifetime = REQUEST_TIMEOUT_DNS
+		# a lost datagram costs one attempt, not the whole lifetime
+		resolv.timeout = REQUEST_TIMEOUT_DNS_TRY
 
-	for i in range(len(domains)):
-		jobs.put(domains[i])
+		if args.nameservers:
+			resolv.nameservers = args.nameservers.split(",")
+		if args.port:
+			resolv.port = args.port
+
+		ns_limits = {ns: threading.BoundedSemaphore(DNS_INFLIGHT_MAX) for ns in resolv.nameservers}
+
+	# CSV rows are written as soon as each domain is done, the other formats
+	# need the complete list
+	results = None
+	if args.format == 'csv':
+		results = queue.Queue()
+		streamer = threading.Thread(target=stream_csv, args=(results,))
+		streamer.results = results
+		streamer.daemon = True
+		streamer.start()
 
 	for i in range(args.threads):
 		worker = DomainThread(jobs)
+		worker.results = results
 		worker.setDaemon(True)
 
 		worker.uri_scheme = url.scheme
@@ -985,6 +1188,8 @@ def main():
 
 		if MODULE_DNSPYTHON:
 			worker.option_extdns = True
+			worker.resolver = resolv
+			worker.ns_limits = ns_limits
 		if MODULE_WHOIS and args.whois:
 			worker.option_whois = True
 		if MODULE_GEOIP and DB_GEOIP and args.geoip:
@@ -1000,19 +1205,35 @@ def main():
 		worker.start()
 		threads.append(worker)
 
+	# progress dots only make sense on a terminal, not in a file or pipe
+	progress = sys.stdout.isatty()
 	qperc = 0
-	while not jobs.empty():
-		p_cli('.')
-		qcurr = 100 * (len(domains) - jobs.qsize()) / len(domains)
-		if qcurr - 15 >= qperc:
-			qperc = qcurr
-			p_cli('%u%%' % qperc)
-		time.sleep(1)
+	while jobs.unfinished_tasks and any(worker.is_alive() for worker in threads):
+		if progress:
+			p_cli('.')
+			qcurr = 100 * (len(domains) - jobs.unfinished_tasks) / len(domains)
+			if qcurr - 15 >= qperc:
+				qperc = qcurr
+				p_cli('%u%%' % qperc)
+		with jobs.all_tasks_done:
+			jobs.all_tasks_done.wait_for(lambda: not jobs.unfinished_tasks, 1)
+
+	incomplete = jobs.unfinished_tasks
 
 	for worker in threads:
 		worker.stop()
+		jobs.put(None)
+	for worker in threads:
 		worker.join()
 
+	if results is not None:
+		results.put(None)
+		streamer.join()
+
+	if incomplete:
+		p_err('error: worker threads died with %d domains left unprocessed\n' % incomplete)
+		bye(-1)
+
 	hits_total = sum('dns-ns' in d or 'dns-a' in d for d in domains)
 	hits_percent = 100 * hits_total / len(domains)
 	p_cli(' %d hits (%d%%)\n\n' % (hits_total, hits_percent))
@@ -1020,13 +1241,11 @@ def main():
 	if args.registered:
 		domains[:] = [d for d in domains if len(d) > 2]
 
-	if domains:
-		if args.format == 'csv':
-			p_csv(generate_csv(domains))
-		elif args.format == 'json':
-			p_json(generate_json(domains))
-		else:
-			p_cli(generate_cli(domains))
+	# CSV has already been streamed while resolving
+	writers = {'json': write_json, 'cli': write_cli}
+
+	if domains and args.format in writers:
+		writers[args.format](domains, sys.stdout)
 
 	bye(0)
 